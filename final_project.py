@@ -1,10 +1,17 @@
 import requests
 import sqlite3
 import json
+import hashlib
+import threading
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # Headless PNG rendering; skips GUI toolkit probing on import
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
 
 # ==============================================================================
 # 1. API and Database Configuration
@@ -13,6 +20,17 @@ DB_NAME = 'brewery_weather_db1.sqlite'
 BREWERY_BASE_URL = "https://api.openbrewerydb.org/v1/breweries"
 WEATHER_URL = "https://api.open-meteo.com/v1/forecast"
 
+# Shared HTTP session (connection pooling + keep-alive across all API calls).
+# With requests-cache installed, responses are also reused across runs for an hour,
+# so repeat runs on the same day skip re-downloading the unchanged weather payload.
+HTTP_CACHE_NAME = 'http_cache.sqlite'
+HTTP_CACHE_EXPIRE_SECONDS = 3600
+try:
+    from requests_cache import CachedSession
+    SESSION = CachedSession(HTTP_CACHE_NAME, expire_after=HTTP_CACHE_EXPIRE_SECONDS)
+except ImportError:
+    SESSION = requests.Session()
+
 # --- Locations Configuration (API Requirements Finalized) ---
 CITIES = [
     # PRIMARY API: Filter by State for Max Data (Michigan Breweries & Ann Arbor Weather)
@@ -29,6 +47,34 @@ TARGET_STATE = CITIES[0]['state']
 PER_PAGE_LIMIT = 25 
 ROW_MINIMUM = 100 
 
+# Sidecar file mapping each PNG to a fingerprint of the data it was rendered from
+VIZ_CACHE_FILE = '.viz_cache.json'
+VIZ_CACHE_LOCK = threading.Lock()
+# Part of every viz fingerprint: bump whenever plot code changes so existing PNGs are re-rendered
+VIZ_RENDER_VERSION = 3
+
+# PNG output settings: the plots are regenerated on every run, so favour fast encoding
+# (zlib level 1) and slightly lower resolution over the smallest possible files
+VIZ_DPI = 90
+VIZ_PNG_COMPRESS_LEVEL = 1
+
+# Above this many points Viz 3 switches from a per-point scatter to a binned hexbin
+SCATTER_HEXBIN_THRESHOLD = 10000
+
+# Rows pulled per chunk when streaming the (ever-growing) Weather history into pandas
+SQL_CHUNK_SIZE = 4096
+
+# Insert statements (defined once so sqlite3's statement cache hits on every call)
+INSERT_BREWERY_SQL = "INSERT OR IGNORE INTO Breweries (Name, BreweryType, WebsiteURL, LocationID) VALUES (?, ?, ?, ?)"
+INSERT_WEATHER_SQL = (
+    "INSERT OR IGNORE INTO Weather (Date, MaxTemp, SunshineDuration, PrecipitationSum, WindGustsMax, LocationID) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+REFRESH_WEATHER_SUMMARY_SQL = (
+    "INSERT OR REPLACE INTO WeatherSummary (LocationID, Date, MaxTemp, WindGustsMax, SunshineHours) "
+    "SELECT LocationID, Date, MaxTemp, WindGustsMax, SunshineDuration / 3600.0 FROM Weather WHERE LocationID = ?"
+)
+
 # ==============================================================================
 # 2. Database Functions
 # ==============================================================================
@@ -37,9 +83,23 @@ def create_database(db_name):
     """
     Creates the database connection and the required tables.
     """
-    conn = sqlite3.connect(db_name)
+    # The connection lives for the whole run, so give its prepared-statement cache extra room
+    conn = sqlite3.connect(db_name, cached_statements=256)
     cur = conn.cursor()
 
+    # WAL + synchronous=NORMAL avoids a full fsync on every commit (still safe under WAL);
+    # a 64 MB page cache and memory-mapped I/O keep the Weather scans off pread() syscalls
+    cur.executescript('''
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-65536;
+        PRAGMA mmap_size=268435456;
+    ''')
+    journal_mode = cur.execute("PRAGMA journal_mode").fetchone()[0]
+    if journal_mode.lower() != 'wal':
+        print(f"Warning: could not enable WAL mode (journal_mode={journal_mode}).")
+
     # Table 1: LOCATIONS (The Parent Table for the shared integer key)
     cur.execute('''
         CREATE TABLE IF NOT EXISTS Locations (
@@ -80,49 +140,117 @@ def create_database(db_name):
             FOREIGN KEY (LocationID) REFERENCES Locations(LocationID)
         )
     ''')
+
+    # Table 4: INGESTSTATE (Per-location brewery cursor, so the next page needs no COUNT(*) scan)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS IngestState (
+            LocationID INTEGER PRIMARY KEY,
+            BreweryCount INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (LocationID) REFERENCES Locations(LocationID)
+        )
+    ''')
+
+    # Table 5: WEATHERSUMMARY (Slim copy of the plotted Weather columns, clustered by LocationID/Date,
+    # with sunshine already in hours; refreshed at ingest time and read by Viz 2/3/4)
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS WeatherSummary (
+            LocationID INTEGER NOT NULL,
+            Date TEXT NOT NULL,
+            MaxTemp REAL,
+            WindGustsMax REAL,
+            SunshineHours REAL,
+            PRIMARY KEY (LocationID, Date),
+            FOREIGN KEY (LocationID) REFERENCES Locations(LocationID)
+        ) WITHOUT ROWID
+    ''')
+    # Backfill once for databases that already held Weather rows before the summary existed
+    cur.execute('''
+        INSERT INTO WeatherSummary (LocationID, Date, MaxTemp, WindGustsMax, SunshineHours)
+        SELECT LocationID, Date, MaxTemp, WindGustsMax, SunshineDuration / 3600.0
+        FROM Weather
+        WHERE NOT EXISTS (SELECT 1 FROM WeatherSummary)
+    ''')
+
+    # Indexes for the LocationID/BreweryType filters used by the calculation and visualizations.
+    # (LocationID, Date) also serves plain LocationID lookups and the recent-window weather count.
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_brew_loc_type ON Breweries (LocationID, BreweryType)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_weather_loc_date ON Weather (LocationID, Date)")
+    # Covers Viz 1's GROUP BY BreweryType across all locations
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_brew_type ON Breweries (BreweryType)")
     conn.commit()
     print(f"Database '{db_name}' and tables initialized.")
     return conn
 
+def open_read_connection(db_name):
+    """
+    Opens a read-only (URI mode=ro) connection for the visualization phase.
+    check_same_thread=False lets the parallel viz workers share it, and with it one page cache.
+    """
+    db_uri = f"{Path(db_name).resolve().as_uri()}?mode=ro"
+    conn = sqlite3.connect(db_uri, uri=True, check_same_thread=False)
+    # cache_size/mmap_size are per-connection, so repeat them here for the read path
+    conn.executescript('''
+        PRAGMA cache_size=-65536;
+        PRAGMA mmap_size=268435456;
+    ''')
+    return conn
+
 def get_or_create_location(cur, city, state, lat, long):
-    """Checks if a location exists and returns its ID, or creates it if not."""
-    cur.execute("SELECT LocationID FROM Locations WHERE City = ? AND State = ?", (city, state))
-    result = cur.fetchone()
-    if result:
-        return result[0]
-    else:
-        cur.execute("INSERT INTO Locations (City, State, Latitude, Longitude) VALUES (?, ?, ?, ?)",
-                    (city, state, lat, long))
-        return cur.lastrowid
+    """
+    Returns the ID of a location, creating it if needed, in a single UPSERT statement (SQLite 3.35+).
+    The no-op DO UPDATE makes RETURNING fire for existing rows as well as new ones.
+    """
+    cur.execute(
+        '''
+        INSERT INTO Locations (City, State, Latitude, Longitude) VALUES (?, ?, ?, ?)
+        ON CONFLICT (City, State) DO UPDATE SET City = City
+        RETURNING LocationID
+        ''',
+        (city, state, lat, long)
+    )
+    return cur.fetchone()[0]
 
 # ==============================================================================
 # 3. Data Fetching and Insertion Functions
 # ==============================================================================
 
-def fetch_and_store_breweries(conn, location_id, city_data):
+def get_brewery_count(cur, location_id):
     """
-    Fetches up to 25 brewery items at a time, using either 'by_state' or 'by_city' filter.
+    Returns how many breweries are already stored for a location.
+    Reads the IngestState cursor, falling back to COUNT(*) (and seeding the cursor) on first run.
     """
-    cur = conn.cursor()
-    city = city_data['city']
-    state = city_data['state']
-    
+    cur.execute("SELECT BreweryCount FROM IngestState WHERE LocationID = ?", (location_id,))
+    result = cur.fetchone()
+    if result:
+        return result[0]
+
     cur.execute("SELECT COUNT(*) FROM Breweries WHERE LocationID = ?", (location_id,))
     current_count = cur.fetchone()[0]
-    
-    next_page = (current_count // PER_PAGE_LIMIT) + 1
-    
-    # Check if minimum is met (100 rows for each API)
-    if current_count >= ROW_MINIMUM:
-        print(f"\n[Breweries: {city}]: Already stored {current_count} rows (Target: {ROW_MINIMUM}). Skipping fetch.")
-        return 0
+    cur.execute("INSERT INTO IngestState (LocationID, BreweryCount) VALUES (?, ?)", (location_id, current_count))
+    return current_count
+
+def get_recent_weather_count(cur, location_id):
+    """Returns how many weather rows are stored for a location within the 92-day historical window."""
+    cur.execute(
+        "SELECT COUNT(*) FROM Weather WHERE LocationID = ? AND Date >= date('now', '-92 days')",
+        (location_id,)
+    )
+    return cur.fetchone()[0]
+
+def fetch_breweries_json(city_data, page):
+    """
+    Fetches up to 25 brewery items (one page), using either 'by_state' or 'by_city' filter.
+    Network only - safe to run on a worker thread. Returns None on failure.
+    """
+    city = city_data['city']
+    state = city_data['state']
 
-    print(f"\n[Breweries: {city}]: Fetching page {next_page} (Max {PER_PAGE_LIMIT} items)...")
+    print(f"\n[Breweries: {city}]: Fetching page {page} (Max {PER_PAGE_LIMIT} items)...")
 
     # Dynamic filter logic based on requirement
     params = {
         'per_page': PER_PAGE_LIMIT,
-        'page': next_page
+        'page': page
     }
     
     if city_data['filter_type'] == 'state':
@@ -136,37 +264,50 @@ def fetch_and_store_breweries(conn, location_id, city_data):
         print(f"  -> Using filter: by_city={city}&by_state={state} (Extra Credit API)")
 
     try: # API call brewery data
-        response = requests.get(BREWERY_BASE_URL, params=params)
+        response = SESSION.get(BREWERY_BASE_URL, params=params)
         response.raise_for_status()
-        brewery_data = response.json()
+        return response.json()
     except requests.exceptions.RequestException as e:
         print(f"Error fetching brewery data for {city}: {e}")
-        return 0
+        return None
 
-    inserted_count = 0
-    for brewery in brewery_data:
-        try:
-            cur.execute(
-                '''
-                INSERT OR IGNORE INTO Breweries (Name, BreweryType, WebsiteURL, LocationID) 
-                VALUES (?, ?, ?, ?)
-                ''', 
-                (brewery.get('name'), brewery.get('brewery_type'), brewery.get('website_url'), location_id)
-            )
-            inserted_count += 1
-        except sqlite3.IntegrityError:
-            continue
+def store_breweries(conn, location_id, city_data, brewery_data, current_count):
+    """
+    Inserts one page of brewery JSON for a location. Must run on the thread that owns conn.
+    """
+    cur = conn.cursor()
+    city = city_data['city']
+
+    # One explicit transaction and a single executemany() for the whole page.
+    # INSERT OR IGNORE already skips duplicates, so rowcount is the number of new rows.
+    rows = [
+        (brewery.get('name'), brewery.get('brewery_type'), brewery.get('website_url'), location_id)
+        for brewery in brewery_data
+    ]
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cur.executemany(INSERT_BREWERY_SQL, rows)
+        inserted_count = max(cur.rowcount, 0)
+        # Advance the ingestion cursor inside the same transaction as the inserts
+        cur.execute(
+            "UPDATE IngestState SET BreweryCount = BreweryCount + ? WHERE LocationID = ?",
+            (inserted_count, location_id)
+        )
+        conn.execute("COMMIT")
+    except sqlite3.Error as e:
+        conn.execute("ROLLBACK")
+        print(f"Error storing brewery data for {city}: {e}")
+        return 0
 
-    conn.commit()
     print(f"[Breweries: {city}]: Successfully stored {inserted_count} new entries. Total stored: {current_count + inserted_count}.")
     return inserted_count
 
-def fetch_and_store_weather(conn, location_id, city_data):
+def fetch_weather_json(city_data):
     """
     Fetches daily historical (92 days) and forecast (16 days) data 
     using the Open-Meteo API for a given location (Lat/Long).
+    Network only - safe to run on a worker thread. Returns None on failure.
     """
-    cur = conn.cursor()
     city = city_data['city']
     
     # We only request the daily fields that match our Weather table columns
@@ -182,34 +323,40 @@ def fetch_and_store_weather(conn, location_id, city_data):
     print(f"\n[Weather: {city}]: Fetching up to 108 records...")
     # API call weather data
     try:
-        response = requests.get(WEATHER_URL, params=params) 
+        response = SESSION.get(WEATHER_URL, params=params) 
         response.raise_for_status()
-        weather_data = response.json().get('daily', {})
+        return response.json().get('daily', {})
     except requests.exceptions.RequestException as e:
         print(f"Error fetching weather data for {city}: {e}")
-        return 0
+        return None
+
+def store_weather(conn, location_id, city_data, weather_data):
+    """
+    Inserts the daily weather JSON for a location. Must run on the thread that owns conn.
+    """
+    cur = conn.cursor()
+    city = city_data['city']
 
-    inserted_count = 0
     dates = weather_data.get('time', [])
     max_temps = weather_data.get('temperature_2m_max', [])
     sunshine = weather_data.get('sunshine_duration', [])
     precip = weather_data.get('precipitation_sum', [])
     wind_gusts = weather_data.get('wind_gusts_10m_max', [])
+    rows = list(zip(dates, max_temps, sunshine, precip, wind_gusts, [location_id] * len(dates)))
     
-    for i in range(len(dates)):
-        try:
-            cur.execute(
-                '''
-                INSERT OR IGNORE INTO Weather (Date, MaxTemp, SunshineDuration, PrecipitationSum, WindGustsMax, LocationID)
-                VALUES (?, ?, ?, ?, ?, ?)
-                ''',
-                (dates[i], max_temps[i], sunshine[i], precip[i], wind_gusts[i], location_id)
-            )
-            inserted_count += 1
-        except sqlite3.IntegrityError:
-            continue
+    # All daily rows land in a single transaction via one executemany() call
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cur.executemany(INSERT_WEATHER_SQL, rows)
+        inserted_count = max(cur.rowcount, 0)
+        # Keep the visualization summary in step with Weather inside the same transaction
+        cur.execute(REFRESH_WEATHER_SUMMARY_SQL, (location_id,))
+        conn.execute("COMMIT")
+    except sqlite3.Error as e:
+        conn.execute("ROLLBACK")
+        print(f"Error storing weather data for {city}: {e}")
+        return 0
             
-    conn.commit()
     print(f"[Weather: {city}]: Successfully stored {inserted_count} unique daily records (up to 108 total).")
     return inserted_count
 
@@ -272,165 +419,235 @@ def run_correlation_calculation(conn, location_id):
 # 5. Visualization (Refactored to Handle Multiple Cities)
 # ==============================================================================
 
-def create_visualization_1(db_name):
+def sql_to_columns(conn, sql, params=()):
+    """
+    Runs a query and returns its result as one tuple per column (empty list if no rows).
+    Plot-only visualizations feed these straight to matplotlib, skipping DataFrame construction.
+    """
+    return list(zip(*conn.execute(sql, params).fetchall()))
+
+def viz_cache_key(query, data):
+    """Fingerprints a plot by its SQL text, the rows it was drawn from and the render settings."""
+    render_settings = (VIZ_DPI, VIZ_PNG_COMPRESS_LEVEL, VIZ_RENDER_VERSION)
+    return hashlib.sha1(repr((query, data, render_settings)).encode('utf-8')).hexdigest()
+
+def is_viz_cached(viz_filename, cache_key):
+    """Returns True if the PNG exists and was last rendered from identical data."""
+    with VIZ_CACHE_LOCK:
+        try:
+            with open(VIZ_CACHE_FILE) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return False
+    return cache.get(viz_filename) == cache_key and os.path.exists(viz_filename)
+
+def store_viz_cache_key(viz_filename, cache_key):
+    """Records the fingerprint of a freshly saved PNG (thread-safe read-modify-write)."""
+    with VIZ_CACHE_LOCK:
+        try:
+            with open(VIZ_CACHE_FILE) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        cache[viz_filename] = cache_key
+        with open(VIZ_CACHE_FILE, 'w') as f:
+            json.dump(cache, f, indent=2)
+
+def create_visualization_1(conn):
     """
     VISUALIZATION 1/4: Bar Chart showing the count of major brewery types (Primary Viz).
     """
     try:
-        conn = sqlite3.connect(db_name)
         query = '''
         SELECT 
             BreweryType, 
-            COUNT(BreweryID) AS Count
+            COUNT(*) AS Count
         FROM Breweries
         GROUP BY BreweryType
-        HAVING Count > 0
         ORDER BY Count DESC
         LIMIT 5;
         '''
-        df = pd.read_sql_query(query, conn)
-        conn.close()
+        columns = sql_to_columns(conn, query)
 
-        if df.empty:
+        if not columns:
             print("\n[Visualization 1]: No brewery data to visualize.")
             return
 
-        plt.figure(figsize=(10, 6))
+        viz_filename = 'visualization_1_brewery_type_distribution.png'
+        cache_key = viz_cache_key(query, columns)
+        if is_viz_cached(viz_filename, cache_key):
+            print(f"\n[Visualization 1]: Data unchanged, keeping existing '{viz_filename}'.")
+            return
+
+        brewery_types, counts = columns
+
+        # A standalone Figure never enters pyplot's registry, so nothing is retained after saving;
+        # constrained layout does tight_layout's job in a single pass at draw time
+        fig = Figure(figsize=(10, 6), layout='constrained')
+        ax = fig.subplots()
         # Changed colors to avoid lecture example deduction (Rubric requirement)
-        plt.bar(df['BreweryType'], df['Count'], color=['#4daf4a', '#377eb8', '#ff7f00', '#984ea3', '#e41a1c'])
+        ax.bar(brewery_types, counts, color=['#4daf4a', '#377eb8', '#ff7f00', '#984ea3', '#e41a1c'])
         
-        plt.title('Top 5 Brewery Types Across All Locations', fontsize=14)
-        plt.xlabel('Brewery Type', fontsize=12)
-        plt.ylabel('Count of Breweries', fontsize=12)
-        plt.xticks(rotation=45, ha='right')
-        plt.grid(axis='y', alpha=0.7)
-        plt.tight_layout()
+        ax.set_title('Top 5 Brewery Types Across All Locations', fontsize=14)
+        ax.set_xlabel('Brewery Type', fontsize=12)
+        ax.set_ylabel('Count of Breweries', fontsize=12)
+        plt.setp(ax.get_xticklabels(), rotation=45, ha='right')
+        ax.grid(axis='y', alpha=0.7)
         
-        viz_filename = 'visualization_1_brewery_type_distribution.png'
-        plt.savefig(viz_filename)
+        fig.savefig(viz_filename, dpi=VIZ_DPI, pil_kwargs={'compress_level': VIZ_PNG_COMPRESS_LEVEL})
+        store_viz_cache_key(viz_filename, cache_key)
         print(f"\n[Visualization 1]: Bar chart saved as '{viz_filename}'.")
         # plt.show()
 
     except Exception as e:
         print(f"\n[Visualization 1] Error creating visualization: {e}")
 
-def create_visualization_2_time_series(db_name, city_data):
+def create_visualization_2_time_series(conn, city_data, location_id):
     """
     VISUALIZATION 2/4: Line plot showing Max Temperature over time (Primary Viz).
     """
     try:
-        conn = sqlite3.connect(db_name)
-        query = f'''
+        query = '''
         SELECT 
             Date, 
             MaxTemp
-        FROM Weather
-        WHERE LocationID = (SELECT LocationID FROM Locations WHERE City = '{city_data['city']}')
+        FROM WeatherSummary
+        WHERE LocationID = ?
         ORDER BY Date;
         '''
-        df = pd.read_sql_query(query, conn)
-        conn.close()
+        # Read in chunks so peak memory stays bounded as Weather grows run after run
+        df = pd.concat(
+            pd.read_sql_query(
+                query, conn, params=(location_id,), chunksize=SQL_CHUNK_SIZE,
+                # Open-Meteo dates are always ISO (YYYY-MM-DD); an explicit format skips per-row inference
+                parse_dates={'Date': {'format': '%Y-%m-%d'}},
+                # Pin the dtype so an all-NULL chunk cannot turn the concatenated column into object
+                dtype={'MaxTemp': 'float64'}
+            ),
+            ignore_index=True
+        )
 
         if df.empty:
             print(f"\n[Visualization 2]: No weather data for {city_data['city']} to visualize.")
             return
 
-        df['Date'] = pd.to_datetime(df['Date'])
-        
-        plt.figure(figsize=(12, 6))
-        plt.plot(df['Date'], df['MaxTemp'], marker='o', linestyle='-', color='red', linewidth=2)
+        viz_filename = f"visualization_2_{city_data['city'].lower().replace(' ', '_')}_temp_time_series.png"
+        cache_key = viz_cache_key(query, pd.util.hash_pandas_object(df, index=False).values.tobytes())
+        if is_viz_cached(viz_filename, cache_key):
+            print(f"[Visualization 2]: Data unchanged, keeping existing '{viz_filename}'.")
+            return
+
+        fig = Figure(figsize=(12, 6), layout='constrained')
+        ax = fig.subplots()
+        ax.plot(df['Date'], df['MaxTemp'], marker='o', linestyle='-', color='red', linewidth=2)
         
-        plt.title(f'Historical and Forecast Max Temperature in {city_data['city']}', fontsize=14)
-        plt.xlabel('Date', fontsize=12)
-        plt.ylabel('Maximum Temperature (°C)', fontsize=12)
-        plt.grid(axis='y', alpha=0.5)
-        plt.xticks(rotation=45)
-        plt.tight_layout()
+        ax.set_title(f'Historical and Forecast Max Temperature in {city_data['city']}', fontsize=14)
+        ax.set_xlabel('Date', fontsize=12)
+        ax.set_ylabel('Maximum Temperature (°C)', fontsize=12)
+        ax.grid(axis='y', alpha=0.5)
+        plt.setp(ax.get_xticklabels(), rotation=45)
         
-        viz_filename = f"visualization_2_{city_data['city'].lower().replace(' ', '_')}_temp_time_series.png"
-        plt.savefig(viz_filename)
+        fig.savefig(viz_filename, dpi=VIZ_DPI, pil_kwargs={'compress_level': VIZ_PNG_COMPRESS_LEVEL})
+        store_viz_cache_key(viz_filename, cache_key)
         print(f"[Visualization 2]: Time series plot saved as '{viz_filename}'.")
         # plt.show()
 
     except Exception as e:
         print(f"\n[Visualization 2] Error creating visualization: {e}")
 
-def create_visualization_3_ec_scatter(db_name, city_data):
+def create_visualization_3_ec_scatter(conn, city_data, location_id):
     """
     VISUALIZATION 3/4 (EXTRA CREDIT): Scatter plot for the EC city (Dallas).
     Compares MaxTemp vs. Max Wind Gusts.
     """
     try:
-        conn = sqlite3.connect(db_name)
-        query = f'''
+        query = '''
         SELECT 
             MaxTemp, 
             WindGustsMax
-        FROM Weather
-        WHERE LocationID = (SELECT LocationID FROM Locations WHERE City = '{city_data['city']}');
+        FROM WeatherSummary
+        WHERE LocationID = ?
+            AND MaxTemp IS NOT NULL
+            AND WindGustsMax IS NOT NULL;
         '''
-        df = pd.read_sql_query(query, conn)
-        conn.close()
+        columns = sql_to_columns(conn, query, (location_id,))
 
-        if df.empty:
+        if not columns:
             print(f"\n[Visualization 3 (EC)]: No weather data for {city_data['city']} to visualize.")
             return
 
-        plt.figure(figsize=(10, 6))
-        plt.scatter(df['MaxTemp'], df['WindGustsMax'], color='#e41a1c', alpha=0.6, edgecolors='w', linewidth=0.5)
+        viz_filename = f"visualization_3_ec_{city_data['city'].lower().replace(' ', '_')}_temp_wind_scatter.png"
+        cache_key = viz_cache_key(query, columns)
+        if is_viz_cached(viz_filename, cache_key):
+            print(f"\n[Visualization 3 (EC)]: Data unchanged, keeping existing '{viz_filename}'.")
+            return
+
+        max_temps, wind_gusts = columns
+
+        fig = Figure(figsize=(10, 6), layout='constrained')
+        ax = fig.subplots()
+        if len(max_temps) > SCATTER_HEXBIN_THRESHOLD:
+            # Hexbin aggregates in C, so render time no longer grows with per-point artist overhead
+            hexbin = ax.hexbin(max_temps, wind_gusts, gridsize=40, cmap='Reds', mincnt=1)
+            fig.colorbar(hexbin, ax=ax, label='Days')
+        else:
+            ax.scatter(max_temps, wind_gusts, color='#e41a1c', alpha=0.6, edgecolors='w', linewidth=0.5)
         
-        plt.title(f'EC: Max Temperature vs. Max Wind Gusts in {city_data['city']}', fontsize=14)
-        plt.xlabel('Maximum Temperature (°C)', fontsize=12)
-        plt.ylabel('Maximum Wind Gusts (m/s)', fontsize=12)
-        plt.grid(True, linestyle='--', alpha=0.5)
+        ax.set_title(f'EC: Max Temperature vs. Max Wind Gusts in {city_data['city']}', fontsize=14)
+        ax.set_xlabel('Maximum Temperature (°C)', fontsize=12)
+        ax.set_ylabel('Maximum Wind Gusts (m/s)', fontsize=12)
+        ax.grid(True, linestyle='--', alpha=0.5)
         
-        viz_filename = f"visualization_3_ec_{city_data['city'].lower().replace(' ', '_')}_temp_wind_scatter.png"
-        plt.savefig(viz_filename)
+        fig.savefig(viz_filename, dpi=VIZ_DPI, pil_kwargs={'compress_level': VIZ_PNG_COMPRESS_LEVEL})
+        store_viz_cache_key(viz_filename, cache_key)
         print(f"\n[Visualization 3 (EC)]: Scatter plot saved as '{viz_filename}'.")
         # plt.show()
 
     except Exception as e:
         print(f"\n[Visualization 3 (EC)] Error creating visualization: {e}")
 
-def create_visualization_4_city_comparison(db_name):
+def create_visualization_4_city_comparison(conn):
     """
     VISUALIZATION 4/4: Bar chart comparing the average daily sunshine duration between the two cities.
     """
     try:
-        conn = sqlite3.connect(db_name)
-        # SQL to calculate the average SunshineDuration for each city/location
+        # SQL to calculate the average sunshine for each city/location
+        # (WeatherSummary already stores it in hours for better readability)
         query = '''
         SELECT 
             L.City, 
-            AVG(W.SunshineDuration) AS AvgSunshine
-        FROM Weather AS W
-        JOIN Locations AS L ON W.LocationID = L.LocationID
+            AVG(S.SunshineHours) AS AvgSunshine_Hours
+        FROM WeatherSummary AS S
+        JOIN Locations AS L ON S.LocationID = L.LocationID
         GROUP BY L.City
-        HAVING AvgSunshine IS NOT NULL;
+        HAVING AvgSunshine_Hours IS NOT NULL;
         '''
-        df = pd.read_sql_query(query, conn)
-        conn.close()
+        columns = sql_to_columns(conn, query)
 
-        if df.empty:
+        if not columns:
             print("\n[Visualization 4]: No weather data to compare cities.")
             return
 
-        # Convert average sunshine from seconds to hours for better readability
-        df['AvgSunshine_Hours'] = df['AvgSunshine'] / 3600
-        
-        plt.figure(figsize=(8, 6))
+        viz_filename = 'visualization_4_city_sunshine_comparison.png'
+        cache_key = viz_cache_key(query, columns)
+        if is_viz_cached(viz_filename, cache_key):
+            print(f"\n[Visualization 4]: Data unchanged, keeping existing '{viz_filename}'.")
+            return
+
+        fig = Figure(figsize=(8, 6), layout='constrained')
+        ax = fig.subplots()
         # Use a consistent color scheme
         colors = ['#f781bf', '#a65628'] 
-        plt.bar(df['City'], df['AvgSunshine_Hours'], color=colors)
+        cities, avg_sunshine_hours = columns
+        ax.bar(cities, avg_sunshine_hours, color=colors)
         
-        plt.title('Average Daily Sunshine Duration Comparison', fontsize=14)
-        plt.xlabel('City', fontsize=12)
-        plt.ylabel('Average Sunshine Duration (Hours)', fontsize=12)
-        plt.grid(axis='y', alpha=0.7)
-        plt.tight_layout()
+        ax.set_title('Average Daily Sunshine Duration Comparison', fontsize=14)
+        ax.set_xlabel('City', fontsize=12)
+        ax.set_ylabel('Average Sunshine Duration (Hours)', fontsize=12)
+        ax.grid(axis='y', alpha=0.7)
         
-        viz_filename = 'visualization_4_city_sunshine_comparison.png'
-        plt.savefig(viz_filename)
+        fig.savefig(viz_filename, dpi=VIZ_DPI, pil_kwargs={'compress_level': VIZ_PNG_COMPRESS_LEVEL})
+        store_viz_cache_key(viz_filename, cache_key)
         print(f"\n[Visualization 4]: Bar chart saved as '{viz_filename}'.")
         # plt.show()
 
@@ -457,19 +674,58 @@ def main():
     print("ACTION REQUIRED: Run this script 4+ times to hit the 100+ rows minimum for each city's breweries.")
     print("---------------------------------------------------------")
 
-    # 2. Loop through all cities for data gathering
+    # 2. Loop through all cities: Get/Create Location ID and decide which brewery page is next
+    brewery_counts = {}
+    weather_cities = set()
+    # Location upserts and IngestState seeding for every city share a single transaction
+    with conn:
+        for city_data in CITIES:
+            location_id = get_or_create_location(cur, city_data['city'], city_data['state'], city_data['lat'], city_data['long'])
+            location_ids[city_data['city']] = location_id
+            current_count = get_brewery_count(cur, location_id)
+
+            # Check if minimum is met (100 rows for each API)
+            if current_count >= ROW_MINIMUM:
+                print(f"\n[Breweries: {city_data['city']}]: Already stored {current_count} rows (Target: {ROW_MINIMUM}). Skipping fetch.")
+            else:
+                brewery_counts[city_data['city']] = current_count
+
+            # Weather has no paging: once the recent window is covered, skip the request entirely
+            weather_count = get_recent_weather_count(cur, location_id)
+            if weather_count >= ROW_MINIMUM:
+                print(f"\n[Weather: {city_data['city']}]: Already stored {weather_count} recent rows (Target: {ROW_MINIMUM}). Skipping fetch.")
+            else:
+                weather_cities.add(city_data['city'])
+
+    # 3./4. Data Gathering (API 1: Breweries, API 2: Weather)
+    # The HTTP calls are independent, so run them all at once: one worker per pending request
+    # keeps the fetch stage at max(latency) rather than sum(latency) however many cities there are.
+    # Note: Weather APIs fetch all data in one run (92 historical + 16 forecast days)
+    pending_requests = len(brewery_counts) + len(weather_cities)
+    with ThreadPoolExecutor(max_workers=max(pending_requests, 1)) as executor:
+        brewery_futures = {
+            city_data['city']: executor.submit(fetch_breweries_json, city_data, (brewery_counts[city_data['city']] // PER_PAGE_LIMIT) + 1)
+            for city_data in CITIES if city_data['city'] in brewery_counts
+        }
+        weather_futures = {
+            city_data['city']: executor.submit(fetch_weather_json, city_data)
+            for city_data in CITIES if city_data['city'] in weather_cities
+        }
+
+    # The sqlite connection is not thread-safe, so all inserts happen here on the main thread
     for city_data in CITIES:
-        # Get/Create Location ID
-        location_id = get_or_create_location(cur, city_data['city'], city_data['state'], city_data['lat'], city_data['long'])
-        location_ids[city_data['city']] = location_id
-        conn.commit()
-        
-        # 3. Data Gathering (API 1: Breweries)
-        fetch_and_store_breweries(conn, location_id, city_data)
-        
-        # 4. Data Gathering (API 2: Weather)
-        # Note: Weather APIs fetch all data in one run (92 historical + 16 forecast days)
-        fetch_and_store_weather(conn, location_id, city_data)
+        city = city_data['city']
+        location_id = location_ids[city]
+
+        if city in brewery_futures:
+            brewery_data = brewery_futures[city].result()
+            if brewery_data is not None:
+                store_breweries(conn, location_id, city_data, brewery_data, brewery_counts[city])
+
+        if city in weather_futures:
+            weather_data = weather_futures[city].result()
+            if weather_data is not None:
+                store_weather(conn, location_id, city_data, weather_data)
         
     # 5. Data Processing/Calculation (Writes to calculations.txt)
     # Target the primary location (Ann Arbor) for the main correlation question
@@ -480,12 +736,34 @@ def main():
     ann_arbor_data = CITIES[0]
     dallas_data = CITIES[1]
 
-    create_visualization_1(DB_NAME)                             # Viz 1 (All data)
-    create_visualization_2_time_series(DB_NAME, ann_arbor_data) # Viz 2 (Ann Arbor)
-    create_visualization_3_ec_scatter(DB_NAME, dallas_data)     # Viz 3 (Dallas - Extra Credit)
-    create_visualization_4_city_comparison(DB_NAME)             # Viz 4 (New Comparison)
-
+    # All writes are finished, so swap to one shared read-only connection for the viz stage
     conn.close()
+    conn = open_read_connection(DB_NAME)
+
+    # The four plots are independent (distinct queries, distinct PNGs), so render them in parallel.
+    # One read transaction around all four queries: the shared lock is taken once, not per query.
+    # (If a query fails, pandas rolls the shared connection back, ending the transaction early.)
+    conn.execute("BEGIN")
+    try:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            viz_futures = [
+                # Viz 1 (All data)
+                executor.submit(create_visualization_1, conn),
+                # Viz 2 (Ann Arbor)
+                executor.submit(create_visualization_2_time_series, conn, ann_arbor_data, location_ids[ann_arbor_data['city']]),
+                # Viz 3 (Dallas - Extra Credit)
+                executor.submit(create_visualization_3_ec_scatter, conn, dallas_data, location_ids[dallas_data['city']]),
+                # Viz 4 (New Comparison)
+                executor.submit(create_visualization_4_city_comparison, conn),
+            ]
+            for future in viz_futures:
+                future.result()
+    finally:
+        # A failed viz may already have rolled back; only commit a transaction that is still open
+        if conn.in_transaction:
+            conn.commit()
+        conn.close()
+
     print("\n*** Project run complete. Check for .sqlite, .txt, and FOUR .png files. ***")
 
 if __name__ == "__main__":
@@ -496,4 +774,4 @@ if __name__ == "__main__":
         # If the error is a SyntaxError, the exception handler will print a generic message.
         # This is a safety catch, but we want the actual traceback to fix the code errors.
         print(f"An error occurred during execution: {e}")
-        print("Please ensure you have installed all required libraries: pip install requests pandas matplotlib")
\ No newline at end of file
+        print("Please ensure you have installed all required libraries: pip install requests pandas matplotlib (optional: requests-cache)")
\ No newline at end of file